@@ -1,10 +1,13 @@
 """Control protocol utilities for the scrcpy Python client."""
 
+import logging
 import socket
 import struct
 import threading
 from typing import Optional, Tuple
 
+log = logging.getLogger(__name__)
+
 # Message types (subset)
 CONTROL_MSG_TYPE_INJECT_KEYCODE = 0
 CONTROL_MSG_TYPE_INJECT_TEXT = 1
@@ -15,6 +18,18 @@ CONTROL_MSG_TYPE_EXPAND_NOTIFICATION_PANEL = 5
 CONTROL_MSG_TYPE_EXPAND_SETTINGS_PANEL = 6
 CONTROL_MSG_TYPE_COLLAPSE_PANELS = 7
 
+# Device message types
+DEVICE_MSG_TYPE_CLIPBOARD = 0
+DEVICE_MSG_TYPE_ACK_CLIPBOARD = 1
+DEVICE_MSG_TYPE_UHID_OUTPUT = 2
+
+# Initial capacity of the outgoing message buffer; it grows on demand.
+SEND_BUFFER_SIZE = 4096
+
+# Every device message has at least 4 bytes after its type byte, so
+# the type and those bytes are always received together as the header.
+DEVICE_MSG_HEADER_SIZE = 5
+
 # Touch actions
 AMOTION_EVENT_ACTION_DOWN = 0
 AMOTION_EVENT_ACTION_UP = 1
@@ -26,6 +41,34 @@ AMOTION_EVENT_BUTTON_TERTIARY = 1 << 2
 
 SC_POINTER_ID_MOUSE = -1 & 0xFFFFFFFFFFFFFFFF
 
+# Pre-compiled message layouts
+_TOUCH = struct.Struct(">BBQiiHHHII")
+_KEYCODE = struct.Struct(">BBIII")
+_TEXT_HDR = struct.Struct(">BI")
+_BACK_OR_SCREEN_ON = struct.Struct(">BB")
+_MSG_TYPE = struct.Struct(">B")
+_U32 = struct.Struct(">I")
+_UHID_HDR = struct.Struct(">HH")
+
+
+def read_into(sock: socket.socket, view: memoryview) -> None:
+    """Fill `view` entirely with bytes read from the socket."""
+    length = len(view)
+    offset = 0
+    while offset < length:
+        n = sock.recv_into(view[offset:])
+        if not n:
+            raise EOFError("socket closed")
+        offset += n
+
+
+def read_exact(sock: socket.socket, length: int) -> bytearray:
+    """Read exactly `length` bytes from the socket."""
+    buf = bytearray(length)
+    read_into(sock, memoryview(buf))
+    return buf
+
+
 # Map pygame key constants to Android key codes (partial)
 try:
     import pygame
@@ -99,19 +142,27 @@ class Control:
 
     def __init__(self, sock: socket.socket) -> None:
         self.sock = sock
-        self.thread: Optional[threading.Thread] = None
         self.resolution: Optional[Tuple[int, int]] = None
         self.mouse_buttons = 0
+        # Outgoing messages are packed in place into this buffer; only the first
+        # _pending_len bytes are queued, so it is reused without reallocating.
+        self._pending = bytearray(SEND_BUFFER_SIZE)
+        self._pending_len = 0
+        self._send_lock = threading.Lock()
+        # Device messages are received incrementally; these hold the partial message.
+        self._device_hdr = bytearray(DEVICE_MSG_HEADER_SIZE)
+        self._device_hdr_len = 0
+        self._device_body: Optional[bytearray] = None
+        self._device_body_len = 0
+        # Raw UTF-8 clipboard content from the device, decoded lazily by `clipboard_text`.
+        # This is the receive buffer itself (no extra copy); treat it as read-only.
+        self.clipboard: Optional[bytearray] = None
+        self._clipboard_text: Optional[str] = None
 
     # ------------------------------------------------------------------
     # Device <-> client communication
-    def start(self) -> None:
-        """Start the control protocol thread."""
-        self.thread = threading.Thread(target=self._device_loop, daemon=True)
-        self.thread.start()
-
     def stop(self) -> None:
-        """Stop the control protocol thread and close the socket."""
+        """Close the control socket."""
         if self.sock:
             try:
                 self.sock.shutdown(socket.SHUT_RDWR)
@@ -119,67 +170,145 @@ class Control:
                 pass
             self.sock.close()
             self.sock = None  # type: ignore[assignment]
-        if self.thread:
-            self.thread.join(timeout=1)
-            self.thread = None
 
     def set_resolution(self, resolution: Tuple[int, int]) -> None:
         """Set the resolution of the device."""
         self.resolution = resolution
 
-    def _device_loop(self) -> None:
-        """Main loop to handle messages from the device."""
-        try:
-            while True:
-                msg_type_raw = self.sock.recv(1)
-                if not msg_type_raw:
-                    break
-                msg_type = msg_type_raw[0]
-                print(f"Device message type {msg_type}")
-                if msg_type == 0:  # DEVICE_MSG_TYPE_CLIPBOARD
-                    length_bytes = self.sock.recv(4)
-                    if not length_bytes:
-                        break
-                    length = struct.unpack(">I", length_bytes)[0]
-                    text = self.sock.recv(length).decode("utf-8")
-                    print("Device clipboard:", text)
-                elif msg_type == 1:  # DEVICE_MSG_TYPE_ACK_CLIPBOARD
-                    self.sock.recv(8)
-                elif msg_type == 2:  # DEVICE_MSG_TYPE_UHID_OUTPUT
-                    hdr = self.sock.recv(4)
-                    if not hdr:
-                        break
-                    ident, size = struct.unpack(">HH", hdr)
-                    self.sock.recv(size)
-                    print(f"UHID output id={ident} size={size}")
-        except Exception:
-            pass
+    @property
+    def clipboard_text(self) -> Optional[str]:
+        """Device clipboard content as text, decoded on first access."""
+        if self._clipboard_text is None and self.clipboard is not None:
+            self._clipboard_text = self.clipboard.decode("utf-8", errors="replace")
+        return self._clipboard_text
+
+    def receive_device_data(self) -> bool:
+        """Receive the next part of a device message, handling the message once complete.
+
+        Performs a single recv, so it does not block when called after the socket was
+        reported readable. Returns False once the socket is closed or a message type is
+        unknown, after which the stream can no longer be parsed.
+        """
+        body = self._device_body
+        if body is None:
+            n = self.sock.recv_into(memoryview(self._device_hdr)[self._device_hdr_len :])
+            if not n:
+                return False
+            self._device_hdr_len += n
+            if self._device_hdr_len < DEVICE_MSG_HEADER_SIZE:
+                return True
+            size = self._device_body_size()
+            if size is None:
+                return False
+            body = self._device_body = bytearray(size)
+            self._device_body_len = 0
+        else:
+            n = self.sock.recv_into(memoryview(body)[self._device_body_len :])
+            if not n:
+                return False
+            self._device_body_len += n
+        if self._device_body_len < len(body):
+            return True
+        self._handle_device_message(body)
+        self._device_hdr_len = 0
+        self._device_body = None
+        return True
+
+    def _device_body_size(self) -> Optional[int]:
+        """Return the number of bytes following the header of the current message, or None if unknown."""
+        hdr = self._device_hdr
+        msg_type = hdr[0]
+        if msg_type == DEVICE_MSG_TYPE_CLIPBOARD:
+            return _U32.unpack_from(hdr, 1)[0]
+        if msg_type == DEVICE_MSG_TYPE_ACK_CLIPBOARD:
+            # 8-byte sequence number, the first half of which is already in hdr
+            return 4
+        if msg_type == DEVICE_MSG_TYPE_UHID_OUTPUT:
+            return _UHID_HDR.unpack_from(hdr, 1)[1]
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Unknown device message type %d, stopping", msg_type)
+        return None
+
+    def _handle_device_message(self, body: bytearray) -> None:
+        """Handle a completely received device message."""
+        msg_type = self._device_hdr[0]
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Device message type %d", msg_type)
+        if msg_type == DEVICE_MSG_TYPE_CLIPBOARD:
+            self.clipboard = body
+            self._clipboard_text = None
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Device clipboard: %d bytes", len(body))
+        elif msg_type == DEVICE_MSG_TYPE_UHID_OUTPUT:
+            if log.isEnabledFor(logging.DEBUG):
+                ident = _UHID_HDR.unpack_from(self._device_hdr, 1)[0]
+                log.debug("UHID output id=%d size=%d", ident, len(body))
 
     # ------------------------------------------------------------------
     # Sending helpers
+    def _reserve(self, size: int) -> int:
+        """Reserve `size` bytes at the end of the queue and return their offset; the caller must hold the send lock."""
+        offset = self._pending_len
+        end = offset + size
+        if end > len(self._pending):
+            self._pending.extend(bytes(max(end - len(self._pending), len(self._pending))))
+        self._pending_len = end
+        return offset
+
+    def _send(self, layout: struct.Struct, *values: int, payload: bytes = b"", flush: bool = True) -> None:
+        """Queue a message after any pending ones, sending everything now if `flush` is set.
+
+        The fixed part of the message is packed with `layout`, followed by the optional `payload`.
+        """
+        with self._send_lock:
+            offset = self._reserve(layout.size + len(payload))
+            layout.pack_into(self._pending, offset, *values)
+            if payload:
+                offset += layout.size
+                self._pending[offset : offset + len(payload)] = payload
+            if flush:
+                self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        """Send all pending messages; the caller must hold the send lock."""
+        if self._pending_len and self.sock:
+            self.sock.sendall(memoryview(self._pending)[: self._pending_len])
+        self._pending_len = 0
+
+    def flush(self) -> None:
+        """Send all queued messages in a single write."""
+        with self._send_lock:
+            self._flush_locked()
+
     def send_text(self, text: str) -> None:
         """Inject text into the device."""
         if not self.sock:
             return
         payload = text.encode("utf-8")
-        msg = struct.pack(">BI", CONTROL_MSG_TYPE_INJECT_TEXT, len(payload)) + payload
-        self.sock.sendall(msg)
-        print(f"Sent text: {text}")
+        self._send(_TEXT_HDR, CONTROL_MSG_TYPE_INJECT_TEXT, len(payload), payload=payload)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Sent text: %s", text)
 
-    def inject_keycode(self, keycode: int, action: int, repeat: int = 0, meta: int = 0) -> None:
-        """Inject a keycode into the device."""
+    def inject_keycode(
+        self, keycode: int, action: int, repeat: int = 0, meta: int = 0, *, flush: bool = False
+    ) -> None:
+        """Inject a keycode into the device.
+
+        The message is queued until the next `flush()` unless `flush` is set.
+        """
         if not self.sock:
             return
-        msg = struct.pack(
-            ">BBIII",
+        self._send(
+            _KEYCODE,
             CONTROL_MSG_TYPE_INJECT_KEYCODE,
             action,
             keycode,
             repeat,
             meta,
+            flush=flush,
         )
-        self.sock.sendall(msg)
-        print(f"Sent keycode {keycode} action {action}")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Sent keycode %d action %d", keycode, action)
 
     # pylint: disable=too-many-arguments
     # pylint: disable=too-many-positional-arguments
@@ -191,16 +320,25 @@ class Control:
         pressure: float,
         action_button: int,
         buttons: int,
+        *,
+        flush: bool = False,
     ) -> None:
-        """Inject a touch event into the device."""
+        """Inject a touch event into the device.
+
+        The message is queued until the next `flush()` unless `flush` is set.
+        """
         if not self.sock or not self.resolution:
             return
         width, height = self.resolution
-        p = int(max(0.0, min(1.0, pressure)) * 0x10000)
-        if p > 0xFFFF:  # pylint: disable=consider-using-min-builtin
+        # Unsigned 16-bit fixed point, where 1.0 (and NaN) saturates to 0xFFFF
+        if 0.0 < pressure < 1.0:
+            p = int(pressure * 0x10000)
+        elif pressure <= 0.0:
+            p = 0
+        else:
             p = 0xFFFF
-        msg = struct.pack(
-            ">BBQiiHHHII",
+        self._send(
+            _TOUCH,
             CONTROL_MSG_TYPE_INJECT_TOUCH_EVENT,
             action,
             SC_POINTER_ID_MOUSE,
@@ -211,26 +349,40 @@ class Control:
             p,
             action_button,
             buttons,
+            flush=flush,
         )
-        self.sock.sendall(msg)
-        print(f"Touch {action} at ({x},{y}) pressure={pressure:.2f} btn={action_button} buttons={buttons}")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                "Touch %d at (%d,%d) pressure=%.2f btn=%d buttons=%d", action, x, y, pressure, action_button, buttons
+            )
 
-    def back_or_screen_on(self, action: int) -> None:
-        """Send a back or screen on action to the device."""
+    def back_or_screen_on(self, action: int, *, flush: bool = False) -> None:
+        """Send a back or screen on action to the device.
+
+        The message is queued until the next `flush()` unless `flush` is set.
+        """
         if not self.sock:
             return
-        msg = struct.pack(">BB", CONTROL_MSG_TYPE_BACK_OR_SCREEN_ON, action)
-        self.sock.sendall(msg)
-        print(f"BACK_OR_SCREEN_ON action {action}")
+        self._send(_BACK_OR_SCREEN_ON, CONTROL_MSG_TYPE_BACK_OR_SCREEN_ON, action, flush=flush)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("BACK_OR_SCREEN_ON action %d", action)
+
+    def expand_notification_panel(self, *, flush: bool = False) -> None:
+        """Expand the notification panel on the device.
 
-    def expand_notification_panel(self) -> None:
-        """Expand the notification panel on the device."""
+        The message is queued until the next `flush()` unless `flush` is set.
+        """
         if self.sock:
-            self.sock.sendall(struct.pack(">B", CONTROL_MSG_TYPE_EXPAND_NOTIFICATION_PANEL))
-            print("Expand notification panel")
+            self._send(_MSG_TYPE, CONTROL_MSG_TYPE_EXPAND_NOTIFICATION_PANEL, flush=flush)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Expand notification panel")
+
+    def collapse_panels(self, *, flush: bool = False) -> None:
+        """Collapse the notification and settings panels on the device.
 
-    def collapse_panels(self) -> None:
-        """Collapse the notification and settings panels on the device."""
+        The message is queued until the next `flush()` unless `flush` is set.
+        """
         if self.sock:
-            self.sock.sendall(struct.pack(">B", CONTROL_MSG_TYPE_COLLAPSE_PANELS))
-            print("Collapse panels")
+            self._send(_MSG_TYPE, CONTROL_MSG_TYPE_COLLAPSE_PANELS, flush=flush)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Collapse panels")
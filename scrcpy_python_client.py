@@ -1,10 +1,13 @@
 """Minimal scrcpy client using ADB and PyAV to stream Android screen."""
 
 import argparse
+import logging
 import os
+import selectors
 import socket
 import struct
 import subprocess
+import sys
 import threading
 import time
 from dataclasses import dataclass, field
@@ -13,6 +16,8 @@ from typing import Optional, Tuple
 import av
 import numpy as np
 import pygame
+from av.codec.hwaccel import HWAccel
+from av.video.reformatter import VideoReformatter
 
 from control import (
     AMOTION_EVENT_ACTION_DOWN,
@@ -21,8 +26,12 @@ from control import (
     ANDROID_KEYCODES,
     MOUSE_BUTTON_MAP,
     Control,
+    read_exact,
+    read_into,
 )
 
+log = logging.getLogger(__name__)
+
 CODECS = {
     0x68323634: "h264",
     0x68323635: "hevc",
@@ -33,21 +42,47 @@ HEADER_SIZE = 12
 FLAG_CONFIG = 1 << 63
 FLAG_KEY_FRAME = 1 << 62
 PTS_MASK = FLAG_KEY_FRAME - 1
+PACKET_BUFFER_SIZE = 1 << 20
+PACKET_HEADER = struct.Struct(">QI")
+# Dummy byte, device name, then codec id, width and height of the video stream
+STREAM_HEADER = struct.Struct(">x64sIII")
+SOCKET_RCVBUF_SIZE = 12 * 1024 * 1024
+# Upper bound on how long the GUI loop sleeps without a new frame, so input is still polled.
+FRAME_WAIT_TIMEOUT = 1 / 60
 
 SERVER_VERSION = "3.3.1"
 DEVICE_SERVER_PATH = "/data/local/tmp/scrcpy-server.jar"
 LOCK_SCREEN_ORIENTATION_UNLOCKED = 0
 
+# Hardware decoder picked by `--hwaccel auto` on each platform
+DEFAULT_HWACCEL = {
+    "linux": "vaapi",
+    "darwin": "videotoolbox",
+    "win32": "d3d11va",
+}
+
+
+def non_negative_int(value: str) -> int:
+    """Parse a command line integer that must not be negative."""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be >= 0, got {number}")
+    return number
+
+
+def tune_socket(sock: socket.socket) -> None:
+    """Disable Nagle and enlarge the kernel receive buffer of a stream socket."""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF_SIZE)
 
-def read_exact(sock: socket.socket, length: int) -> bytes:
-    """Read exactly `length` bytes from the socket."""
-    buf = bytearray()
-    while len(buf) < length:
-        chunk = sock.recv(length - len(buf))
-        if not chunk:
-            raise EOFError("socket closed")
-        buf.extend(chunk)
-    return bytes(buf)
+
+def frame_to_rgb(reformatter: VideoReformatter, frame: av.VideoFrame) -> np.ndarray:
+    """Convert a decoded frame to an RGB24 array.
+
+    The reformatter reuses its SwsContext. The returned array views the newly allocated RGB
+    frame, so it is never written again once returned.
+    """
+    return reformatter.reformat(frame, format="rgb24").to_ndarray()
 
 
 @dataclass
@@ -68,6 +103,8 @@ class ClientConfig:
     lock_screen_orientation: int = LOCK_SCREEN_ORIENTATION_UNLOCKED
     docker: bool = False
     control: bool = True
+    hwaccel: Optional[str] = None
+    decode_cpu: Optional[int] = None
 
 
 @dataclass
@@ -75,7 +112,12 @@ class ClientState:  # pylint: disable=too-many-instance-attributes
     """Dynamic state during runtime."""
 
     proc: Optional[subprocess.Popen] = None
-    last_frame: Optional[np.ndarray] = None
+    # Newest converted frame not yet taken by the GUI. Every frame is a fresh array, so handing
+    # over the reference under `frame_lock` is enough to keep the two threads apart.
+    ready_frame: Optional[np.ndarray] = None
+    frame_seq: int = 0
+    consumed_seq: int = 0
+    frame_lock: threading.Lock = field(default_factory=threading.Lock)
     resolution: Optional[Tuple[int, int]] = None
     device_name: Optional[str] = None
     thread: Optional[threading.Thread] = None
@@ -83,6 +125,7 @@ class ClientState:  # pylint: disable=too-many-instance-attributes
     control: Optional[Control] = None
     log_thread: Optional[threading.Thread] = None
     stop_event: threading.Event = field(default_factory=threading.Event)
+    frame_ready: threading.Event = field(default_factory=threading.Event)
 
 
 class Client:
@@ -198,13 +241,15 @@ class Client:
         time.sleep(1)
         print("Connecting to video socket...")
         self.state.video_sock = socket.create_connection((self.config.host, self.config.port))
+        tune_socket(self.state.video_sock)
         print("Video socket connected")
         if self.config.control:
             print("Connecting to control socket...")
             control_sock = socket.create_connection((self.config.host, self.config.port))
+            tune_socket(control_sock)
             print("Control socket connected")
+            # Device messages are received by the video thread, a non-blocking chunk at a time.
             self.state.control = Control(control_sock)
-            self.state.control.start()
 
         self.state.thread = threading.Thread(target=self._video_loop, args=(self.state.video_sock,), daemon=True)
         self.state.thread.start()
@@ -212,46 +257,142 @@ class Client:
     def _init_decoder(self, sock: socket.socket) -> Tuple[av.CodecContext, int, int]:
         """Initialize decoder and return decoder, width, and height."""
         print("Initializing decoder...")
-        _ = read_exact(sock, 1)
-        self.state.device_name = read_exact(sock, 64).split(b"\0", 1)[0].decode()
-        raw_codec = struct.unpack(">I", read_exact(sock, 4))[0]
-        self.state.resolution = struct.unpack(">II", read_exact(sock, 8))
-        width_, height_ = self.state.resolution
+        raw_name, raw_codec, width_, height_ = STREAM_HEADER.unpack(read_exact(sock, STREAM_HEADER.size))
+        self.state.device_name = raw_name.split(b"\0", 1)[0].decode()
+        self.state.resolution = (width_, height_)
         if self.state.control:
             self.state.control.set_resolution(self.state.resolution)
         codec_name = CODECS.get(raw_codec)
         if not codec_name:
             raise RuntimeError(f"Unsupported codec id: {raw_codec:#x}")
         print(f"Connected to '{self.state.device_name}': codec={codec_name} size={width_}x{height_}")
-        decoder = av.CodecContext.create(codec_name, "r")
+        decoder = self._create_decoder(codec_name)
         return decoder, width_, height_
 
+    def _create_decoder(self, codec_name: str) -> av.CodecContext:
+        """Create the video decoder, using hardware acceleration when configured and available."""
+        device_type = self.config.hwaccel
+        if device_type == "auto":
+            device_type = DEFAULT_HWACCEL.get(sys.platform)
+        if device_type:
+            try:
+                hwaccel = HWAccel(device_type=device_type, allow_software_fallback=True)
+                decoder = av.CodecContext.create(codec_name, "r", hwaccel=hwaccel)
+            except Exception as exc:
+                print(f"Hardware decoding with {device_type} unavailable ({exc}), using software decoder")
+            else:
+                # With software fallback allowed, PyAV may silently open a software decoder.
+                if decoder.is_hwaccel:
+                    print(f"Using {device_type} hardware decoding")
+                else:
+                    print(f"Hardware decoding with {device_type} unavailable for {codec_name}, using software decoder")
+                return decoder
+        return av.CodecContext.create(codec_name, "r")
+
+    def _publish_frame(self, reformatter: VideoReformatter, frame: av.VideoFrame) -> None:
+        """Convert `frame` to RGB and make it the ready frame, replacing any frame not yet taken."""
+        state = self.state
+        img = frame_to_rgb(reformatter, frame)
+        with state.frame_lock:
+            state.ready_frame = img
+            state.frame_seq += 1
+        state.frame_ready.set()
+
+    def take_frame(self) -> Optional[np.ndarray]:
+        """Return the newest frame not yet taken, or None if there is none.
+
+        Called from the GUI thread. The video thread never writes into a frame after publishing it.
+        """
+        state = self.state
+        with state.frame_lock:
+            if state.frame_seq == state.consumed_seq:
+                return None
+            state.consumed_seq = state.frame_seq
+            frame, state.ready_frame = state.ready_frame, None
+        return frame
+
+    def _pin_decode_thread(self) -> None:
+        """Pin the calling thread to the configured CPU core, where the platform supports it."""
+        cpu = self.config.decode_cpu
+        if cpu is None:
+            return
+        if not hasattr(os, "sched_setaffinity"):
+            print("CPU pinning is not supported on this platform")
+            return
+        try:
+            # 0 targets the calling thread, not the whole process
+            os.sched_setaffinity(0, {cpu})
+        except (OSError, ValueError, OverflowError) as exc:
+            print(f"Could not pin decode thread to CPU {cpu}: {exc}")
+
+    def _poll_control(self, selector: selectors.BaseSelector) -> None:
+        """Receive pending device message data, unregistering the control socket once it is unusable."""
+        control = self.state.control
+        if not control or not control.sock:
+            return
+        try:
+            if control.receive_device_data():
+                return
+        except OSError:
+            pass
+        selector.unregister(control.sock)
+
     def _video_loop(self, sock: socket.socket) -> None:
-        """Main loop to receive and decode video packets."""
+        """Main loop to receive and decode video packets and device messages."""
+        selector = selectors.DefaultSelector()
         try:
+            self._pin_decode_thread()
             decoder, _, _ = self._init_decoder(sock)
-            config_data = b""
+            # Reused for every packet; only reallocated when a larger packet arrives. Layout is
+            # [header][pending config packet][packet], so a config packet is prepended to the
+            # next packet without concatenating.
+            config_len = 0
+            scratch = bytearray(PACKET_BUFFER_SIZE)
+            view = memoryview(scratch)
+            # The SwsContext is cached across frames.
+            reformatter = VideoReformatter()
+            # One thread waits on both sockets instead of one blocking thread per socket.
+            selector.register(sock, selectors.EVENT_READ)
+            control_sock = self.state.control.sock if self.state.control else None
+            if control_sock:
+                selector.register(control_sock, selectors.EVENT_READ)
 
             while not self.state.stop_event.is_set():
+                # The timeout re-checks stop_event in case the sockets are closed while not selecting.
                 try:
-                    header = read_exact(sock, HEADER_SIZE)
+                    ready = {key.fileobj for key, _ in selector.select(timeout=0.5)}
+                except OSError:
+                    break
+                if control_sock is not None and control_sock in ready:
+                    self._poll_control(selector)
+                if sock not in ready:
+                    continue
+                try:
+                    read_into(sock, view[:HEADER_SIZE])
                 except (OSError, EOFError):
                     break
-                pts_flags, size = struct.unpack(">QI", header)
+                pts_flags, size = PACKET_HEADER.unpack_from(scratch)
+                # A new config packet replaces any pending one.
+                is_config = pts_flags & FLAG_CONFIG
+                start = HEADER_SIZE if is_config else HEADER_SIZE + config_len
+                end = start + size
+                if end > len(scratch):
+                    grown = bytearray(end)
+                    grown[:start] = view[:start]
+                    view.release()
+                    scratch = grown
+                    view = memoryview(scratch)
                 try:
-                    packet_data = read_exact(sock, size)
+                    read_into(sock, view[start:end])
                 except (OSError, EOFError):
                     break
 
-                if pts_flags & FLAG_CONFIG:
-                    config_data = packet_data
+                if is_config:
+                    config_len = size
                     continue
 
-                if config_data:
-                    packet_data = config_data + packet_data
-                    config_data = b""
-
-                packet = av.Packet(packet_data)
+                packet = av.Packet(view[HEADER_SIZE:end])
+                config_len = 0
                 packet.pts = pts_flags & PTS_MASK
                 if pts_flags & FLAG_KEY_FRAME:
                     try:
@@ -260,11 +401,12 @@ class Client:
                         pass
 
                 for decoded_frame in decoder.decode(packet):
-                    img = decoded_frame.to_ndarray(format="rgb24")
-                    self.state.last_frame = img
-                    print("Received frame", decoded_frame.pts)
+                    self._publish_frame(reformatter, decoded_frame)
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug("Received frame %s", decoded_frame.pts)
 
         finally:
+            selector.close()
             self._stop_server()
 
 
@@ -275,7 +417,23 @@ if __name__ == "__main__":
     parser.add_argument("--host", default="127.0.0.1", help="host to connect to")
     parser.add_argument("--port", type=int, default=27183, help="local TCP port")
     parser.add_argument("--adb-host", default="127.0.0.1:5037", help="adb server host:port")
+    parser.add_argument(
+        "--hwaccel",
+        nargs="?",
+        const="auto",
+        default=None,
+        help="hardware decoder device type (e.g. vaapi, cuda, videotoolbox, d3d11va); 'auto' picks one per platform",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every frame and control event")
+    parser.add_argument(
+        "--decode-cpu",
+        type=non_negative_int,
+        default=None,
+        help="pin the decode thread to this CPU (Linux only)",
+    )
     parsed_args = parser.parse_args()
+    if parsed_args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
 
     config_obj = ClientConfig(
         adb=parsed_args.adb,
@@ -283,6 +441,8 @@ if __name__ == "__main__":
         host=parsed_args.host,
         port=parsed_args.port,
         ip=parsed_args.adb_host,
+        hwaccel=parsed_args.hwaccel,
+        decode_cpu=parsed_args.decode_cpu,
     )
 
     client = Client(config_obj)
@@ -290,13 +450,16 @@ if __name__ == "__main__":
     # GUI must be handled in main thread
     pygame.init()
     SCREEN = None
-    clock = pygame.time.Clock()
 
     try:
         while True:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     raise KeyboardInterrupt
+                # Frames only arrive when the device screen changes, so repaint an uncovered
+                # or restored window from the pixels SCREEN still holds.
+                if event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE) and SCREEN is not None:
+                    pygame.display.flip()
                 if event.type in (pygame.KEYDOWN, pygame.KEYUP):
                     ACTION = AMOTION_EVENT_ACTION_DOWN if event.type == pygame.KEYDOWN else AMOTION_EVENT_ACTION_UP
                     mods = pygame.key.get_mods()
@@ -357,18 +520,26 @@ if __name__ == "__main__":
                         client.state.control.mouse_buttons,
                     )
 
-            if client.state.last_frame is not None:
-                current_frame = client.state.last_frame
+            # Control messages queued while handling this batch of input go out in one write.
+            if client.state.control:
+                client.state.control.flush()
+
+            current_frame = client.take_frame()
+            if current_frame is not None:
                 frame_height, frame_width, _ = current_frame.shape
 
-                if SCREEN is None:
+                # The window follows the frame size, e.g. on rotation.
+                if SCREEN is None or SCREEN.get_size() != (frame_width, frame_height):
                     SCREEN = pygame.display.set_mode((frame_width, frame_height))
 
-                surface = pygame.image.frombuffer(current_frame.tobytes(), (frame_width, frame_height), "RGB")
-                SCREEN.blit(surface, (0, 0))
+                # Pixels are written straight into the window surface, with no intermediate
+                # surface or extra blit. surfarray expects (width, height, 3).
+                pygame.surfarray.blit_array(SCREEN, current_frame.swapaxes(0, 1))
                 pygame.display.flip()
 
-            clock.tick(60)
+            # Sleep until the video thread publishes a frame instead of ticking a fixed clock.
+            client.state.frame_ready.wait(timeout=FRAME_WAIT_TIMEOUT)
+            client.state.frame_ready.clear()
 
     except KeyboardInterrupt:
         print("Exiting...")